@@ -16,6 +16,9 @@ from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import configparser
 import re
+import struct
+import tempfile
+from collections import deque
 
 # Setup logging with more robust error handling
 def setup_logging():
@@ -61,10 +64,26 @@ DEFAULT_CONFIG = {
         "screenshot_prefix": "Screenshot",
         "max_retries": "3",
         "retry_delay": "2"  # seconds
+    },
+    "Budget": {
+        "tokens_per_hour": "0",  # 0 disables the limit
+        "tokens_per_day": "0",  # 0 disables the limit
+        "reduce_threshold": "0.8",  # fraction of a limit at which to economize
+        "reduced_image_size": "1024",  # pixels, longest edge
+        "defer_delay": "60"  # seconds
     }
 }
 
 CONFIG_PATH = os.path.expanduser("~/.config/snapsense/config.ini")
+USAGE_PATH = os.path.expanduser("~/.config/snapsense/usage.jsonl")
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# Budget states reported by UsageTracker.budget_state()
+BUDGET_NORMAL = "normal"
+BUDGET_REDUCED = "reduced"
+BUDGET_EXHAUSTED = "exhausted"
 
 def ensure_config_exists():
     """Ensure the config file exists, create with defaults if it doesn't."""
@@ -82,14 +101,209 @@ def ensure_config_exists():
     return load_config()
 
 def load_config():
-    """Load configuration from the config file."""
+    """Load configuration from the config file, falling back to the defaults."""
     config = configparser.ConfigParser()
+    config.read_dict(DEFAULT_CONFIG)
     config.read(CONFIG_PATH)
     return config
 
+class UsageTracker:
+    """Record per-request token and upload usage in a rolling 24 hour window.
+
+    Entries are appended to USAGE_PATH so that `snapsense status` can report
+    totals for the running daemon.
+    """
+
+    def __init__(self, path=USAGE_PATH, tokens_per_hour=0, tokens_per_day=0, reduce_threshold=0.8):
+        self.path = path
+        self.tokens_per_hour = tokens_per_hour
+        self.tokens_per_day = tokens_per_day
+        self.reduce_threshold = reduce_threshold
+        self.lock = threading.Lock()
+        self.entries = deque()
+        self.load()
+
+    @classmethod
+    def from_config(cls, config):
+        """Create a tracker using the [Budget] section of the configuration."""
+        return cls(
+            path=USAGE_PATH,
+            tokens_per_hour=config.getint("Budget", "tokens_per_hour", fallback=0),
+            tokens_per_day=config.getint("Budget", "tokens_per_day", fallback=0),
+            reduce_threshold=config.getfloat("Budget", "reduce_threshold", fallback=0.8)
+        )
+
+    def load(self):
+        """Load usage entries from disk, dropping anything outside the window."""
+        self.entries.clear()
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        self.entries.append(json.loads(line))
+                    except ValueError:
+                        # Skip partially written or corrupted lines
+                        continue
+        except IOError as e:
+            logger.error(f"Error reading usage file: {e}")
+        self.prune()
+
+    def prune(self):
+        """Drop entries older than a day. Returns True if anything was dropped."""
+        cutoff = time.time() - DAY
+        pruned = False
+        while self.entries and self.entries[0].get("time", 0) < cutoff:
+            self.entries.popleft()
+            pruned = True
+        return pruned
+
+    def record(self, input_tokens, output_tokens, upload_bytes, width, height):
+        """Record the usage of a single API request."""
+        entry = {
+            "time": time.time(),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "upload_bytes": upload_bytes,
+            "width": width,
+            "height": height
+        }
+        with self.lock:
+            self.entries.append(entry)
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                if self.prune():
+                    # Rewrite the file so it doesn't grow without bound
+                    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+                    with os.fdopen(fd, 'w') as f:
+                        for e in self.entries:
+                            f.write(json.dumps(e) + "\n")
+                    os.replace(tmp_path, self.path)
+                else:
+                    with open(self.path, 'a') as f:
+                        f.write(json.dumps(entry) + "\n")
+            except (IOError, OSError) as e:
+                logger.error(f"Error writing usage file: {e}")
+
+    def totals(self, window):
+        """Return usage totals for the last `window` seconds."""
+        cutoff = time.time() - window
+        totals = {
+            "requests": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "upload_bytes": 0,
+            "width": 0,
+            "height": 0
+        }
+        with self.lock:
+            for e in self.entries:
+                if e.get("time", 0) < cutoff:
+                    continue
+                totals["requests"] += 1
+                totals["input_tokens"] += e.get("input_tokens", 0)
+                totals["output_tokens"] += e.get("output_tokens", 0)
+                totals["upload_bytes"] += e.get("upload_bytes", 0)
+                totals["width"] += e.get("width", 0)
+                totals["height"] += e.get("height", 0)
+        totals["tokens"] = totals["input_tokens"] + totals["output_tokens"]
+        return totals
+
+    def budget_state(self):
+        """Compare usage against the configured limits."""
+        state = BUDGET_NORMAL
+        for limit, window in ((self.tokens_per_hour, HOUR), (self.tokens_per_day, DAY)):
+            if limit <= 0:
+                continue
+            used = self.totals(window)["tokens"]
+            if used >= limit:
+                return BUDGET_EXHAUSTED
+            if used >= limit * self.reduce_threshold:
+                state = BUDGET_REDUCED
+        return state
+
+def get_image_dimensions(image_path, image_data=None):
+    """Return (width, height) of an image, or (0, 0) if it can't be determined."""
+    # PNG stores the dimensions in the IHDR chunk right after the signature
+    if image_data and image_data[:8] == b'\x89PNG\r\n\x1a\n' and len(image_data) >= 24:
+        return struct.unpack('>II', image_data[16:24])
+    
+    # Fall back to sips for other formats
+    try:
+        result = subprocess.run(['sips', '-g', 'pixelWidth', '-g', 'pixelHeight', str(image_path)],
+                               capture_output=True, text=True, check=False)
+        width = re.search(r'pixelWidth:\s*(\d+)', result.stdout)
+        height = re.search(r'pixelHeight:\s*(\d+)', result.stdout)
+        if width and height:
+            return int(width.group(1)), int(height.group(1))
+    except (subprocess.SubprocessError, FileNotFoundError):
+        pass
+    return 0, 0
+
+def downscale_image(image_path, max_size):
+    """Return the image as PNG data scaled so its longest edge is at most max_size, or None on failure."""
+    fd, tmp_path = tempfile.mkstemp(suffix=".png")
+    os.close(fd)
+    try:
+        result = subprocess.run(['sips', '-s', 'format', 'png', '-Z', str(max_size),
+                                 str(image_path), '--out', tmp_path],
+                               capture_output=True, text=True, check=False)
+        if result.returncode != 0:
+            logger.error(f"Error downscaling image: {result.stderr.strip()}")
+            return None
+        with open(tmp_path, "rb") as f:
+            return f.read()
+    except (subprocess.SubprocessError, FileNotFoundError, IOError) as e:
+        logger.error(f"Error downscaling image: {str(e)}")
+        return None
+    finally:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+def format_bytes(num_bytes):
+    """Format a byte count for display."""
+    if num_bytes < 1024:
+        return f"{num_bytes} B"
+    for unit in ('KB', 'MB', 'GB'):
+        num_bytes /= 1024
+        if num_bytes < 1024:
+            break
+    return f"{num_bytes:.1f} {unit}"
+
+def print_usage_report(config):
+    """Print token and upload totals along with the configured budget."""
+    usage = UsageTracker.from_config(config)
+    hour = usage.totals(HOUR)
+    day = usage.totals(DAY)
+    
+    print("\nUsage (last hour / last 24 hours):")
+    print(f"  Requests: {hour['requests']} / {day['requests']}")
+    print(f"  Input tokens: {hour['input_tokens']} / {day['input_tokens']}")
+    print(f"  Output tokens: {hour['output_tokens']} / {day['output_tokens']}")
+    print(f"  Uploaded: {format_bytes(hour['upload_bytes'])} / {format_bytes(day['upload_bytes'])}")
+    if day['requests']:
+        print(f"  Average image: {day['width'] // day['requests']}x{day['height'] // day['requests']}")
+    
+    hourly = usage.tokens_per_hour or "unlimited"
+    daily = usage.tokens_per_day or "unlimited"
+    print(f"  Budget: {hourly} tokens/hour, {daily} tokens/day ({usage.budget_state()})")
+
 # Create a global processing queue and worker thread
 processing_queue = queue.Queue()
 
+# Screenshots found at startup; these are deferred first when the budget runs low
+backlog_paths = set()
+
+# Screenshots held back by the queue worker until the budget allows them
+deferred_paths = []
+
+def should_defer(state, file_path):
+    """Defer everything when over budget, and backlog work when close to it."""
+    return state == BUDGET_EXHAUSTED or (state == BUDGET_REDUCED and file_path in backlog_paths)
+
 class ScreenshotHandler(FileSystemEventHandler):
     def __init__(self, config):
         self.config = config
@@ -102,6 +316,9 @@ class ScreenshotHandler(FileSystemEventHandler):
         self.screenshot_prefix = self.config["General"]["screenshot_prefix"]
         self.max_retries = int(self.config["General"]["max_retries"])
         self.retry_delay = int(self.config["General"]["retry_delay"])
+        self.reduced_image_size = self.config.getint("Budget", "reduced_image_size", fallback=1024)
+        self.defer_delay = self.config.getint("Budget", "defer_delay", fallback=60)
+        self.usage = UsageTracker.from_config(self.config)
         
         # Image file extensions to process
         self.image_extensions = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tiff'}
@@ -161,6 +378,17 @@ class ScreenshotHandler(FileSystemEventHandler):
         try:
             with open(image_path, "rb") as f:
                 image_data = f.read()
+            width, height = get_image_dimensions(image_path, image_data)
+            
+            # Send a smaller image when we're close to the token budget
+            if self.usage.budget_state() == BUDGET_REDUCED and max(width, height) > self.reduced_image_size:
+                reduced_data = downscale_image(image_path, self.reduced_image_size)
+                if reduced_data:
+                    image_data = reduced_data
+                    width, height = get_image_dimensions(image_path, image_data)
+                    logger.info(f"Token budget low, sending image downscaled to {width}x{height}")
+            
+            encoded_data = base64.standard_b64encode(image_data).decode("utf-8")
             
             message = self.client.messages.create(
                 model="claude-3-7-sonnet-20250219",
@@ -176,7 +404,7 @@ class ScreenshotHandler(FileSystemEventHandler):
                                 "source": {
                                     "type": "base64",
                                     "media_type": "image/png",
-                                    "data": base64.standard_b64encode(image_data).decode("utf-8")
+                                    "data": encoded_data
                                 }
                             },
                             {
@@ -188,6 +416,16 @@ class ScreenshotHandler(FileSystemEventHandler):
                 ]
             )
             
+            self.usage.record(
+                message.usage.input_tokens,
+                message.usage.output_tokens,
+                len(image_data),
+                width,
+                height
+            )
+            logger.info(f"Usage: {message.usage.input_tokens} input tokens, "
+                        f"{message.usage.output_tokens} output tokens, {len(image_data)} bytes")
+            
             # Extract the suggested filename
             suggested_name = message.content[0].text.strip()
             
@@ -240,6 +478,7 @@ def scan_directory(config):
                     # Check if it starts with the screenshot prefix
                     if path.stem.startswith(handler.screenshot_prefix):
                         logger.info(f"Adding existing screenshot to queue: {file_path}")
+                        backlog_paths.add(file_path)
                         processing_queue.put(file_path)
     except Exception as e:
         logger.error(f"Error scanning directory: {str(e)}")
@@ -250,13 +489,46 @@ def process_queue_worker(config):
     
     logger.info("Starting queue processing worker")
     
+    next_check = 0
     while True:
         try:
-            # Get a file path from the queue (blocks until an item is available)
-            file_path = processing_queue.get()
+            # Re-check the budget for deferred screenshots once per defer_delay
+            if deferred_paths and time.time() >= next_check:
+                state = handler.usage.budget_state()
+                ready = [p for p in deferred_paths if not should_defer(state, p)]
+                if ready:
+                    logger.info(f"Token budget {state}, resuming {len(ready)} deferred screenshots")
+                    deferred_paths[:] = [p for p in deferred_paths if p not in ready]
+                    for p in ready:
+                        processing_queue.put(p)
+                next_check = time.time() + handler.defer_delay
+            
+            # Get a file path from the queue, waking up for the next budget check
+            timeout = max(0, next_check - time.time()) if deferred_paths else None
+            try:
+                file_path = processing_queue.get(timeout=timeout)
+            except queue.Empty:
+                continue
+            
+            # Skip files that were renamed or removed while waiting
+            if not os.path.exists(file_path):
+                backlog_paths.discard(file_path)
+                processing_queue.task_done()
+                continue
+            
+            # Hold the file back without blocking live screenshots behind it
+            state = handler.usage.budget_state()
+            if should_defer(state, file_path):
+                if not deferred_paths:
+                    next_check = time.time() + handler.defer_delay
+                logger.info(f"Token budget {state}, deferring {file_path}")
+                deferred_paths.append(file_path)
+                processing_queue.task_done()
+                continue
             
             # Process the file
             handler.process_file(file_path)
+            backlog_paths.discard(file_path)
             
             # Mark the task as done
             processing_queue.task_done()
@@ -460,14 +732,17 @@ def main():
         if pid and is_process_running(pid):
             print(f"SnapSense is running (PID: {pid})")
             
-            # Show configuration
             config = load_config()
+            print_usage_report(config)
+            
+            # Show configuration
             print("\nCurrent configuration:")
             print(f"  Scan directory: {config['General']['scan_directory']}")
             print(f"  Scan interval: {config['General']['scan_interval']} seconds")
             print(f"  Screenshot prefix: {config['General']['screenshot_prefix']}")
         else:
             print("SnapSense is not running")
+            print_usage_report(load_config())
     
     elif args.action == 'config':
         # Open the config file in the default editor
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Unit tests for SnapSense usage accounting and the token budget.
+"""
+
+import io
+import os
+import sys
+import json
+import queue
+import base64
+import struct
+import tempfile
+import unittest
+from unittest import mock
+
+import snapsense
+from snapsense import (
+    UsageTracker, ScreenshotHandler, get_image_dimensions, format_bytes,
+    HOUR, DAY, BUDGET_NORMAL, BUDGET_REDUCED, BUDGET_EXHAUSTED
+)
+
+NOW = 1_000_000_000.0
+
+
+def png_header(width, height):
+    """Return the signature and IHDR chunk of a PNG with the given dimensions."""
+    ihdr = struct.pack('>II', width, height) + b'\x08\x06\x00\x00\x00'
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', len(ihdr)) + b'IHDR' + ihdr
+
+
+class UsageTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "usage.jsonl")
+        patcher = mock.patch.object(snapsense.time, "time", return_value=NOW)
+        self.mock_time = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_entries(self, *ages):
+        with open(self.path, 'w') as f:
+            for age in ages:
+                f.write(json.dumps({"time": NOW - age, "input_tokens": 10, "output_tokens": 1}) + "\n")
+
+    def read_lines(self):
+        with open(self.path) as f:
+            return f.read().splitlines()
+
+    def test_record_appends_and_totals(self):
+        tracker = UsageTracker(self.path)
+        tracker.record(100, 5, 2048, 1920, 1080)
+        tracker.record(200, 7, 1024, 1280, 720)
+
+        self.assertEqual(len(self.read_lines()), 2)
+        totals = tracker.totals(HOUR)
+        self.assertEqual(totals["requests"], 2)
+        self.assertEqual(totals["input_tokens"], 300)
+        self.assertEqual(totals["output_tokens"], 12)
+        self.assertEqual(totals["tokens"], 312)
+        self.assertEqual(totals["upload_bytes"], 3072)
+        self.assertEqual(totals["width"], 3200)
+        self.assertEqual(totals["height"], 1800)
+
+    def test_totals_respect_window(self):
+        self.write_entries(2 * HOUR, 10)
+        tracker = UsageTracker(self.path)
+
+        self.assertEqual(tracker.totals(HOUR)["requests"], 1)
+        self.assertEqual(tracker.totals(DAY)["requests"], 2)
+
+    def test_load_prunes_entries_older_than_a_day(self):
+        self.write_entries(DAY + 1, HOUR)
+        tracker = UsageTracker(self.path)
+
+        self.assertEqual(len(tracker.entries), 1)
+        self.assertEqual(tracker.entries[0]["time"], NOW - HOUR)
+
+    def test_record_rewrites_file_when_entries_expire(self):
+        self.write_entries(DAY - 1, HOUR)
+        tracker = UsageTracker(self.path)
+        self.mock_time.return_value = NOW + 2
+
+        tracker.record(50, 1, 10, 0, 0)
+
+        lines = self.read_lines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual([json.loads(line)["time"] for line in lines], [NOW - HOUR, NOW + 2])
+
+    def test_load_skips_corrupted_lines(self):
+        with open(self.path, 'w') as f:
+            f.write(json.dumps({"time": NOW, "input_tokens": 10}) + "\n")
+            f.write('{"time": \n')
+            f.write(json.dumps({"time": NOW, "input_tokens": 20}) + "\n")
+        tracker = UsageTracker(self.path)
+
+        self.assertEqual(tracker.totals(HOUR)["input_tokens"], 30)
+
+    def test_zero_limits_are_unlimited(self):
+        tracker = UsageTracker(self.path)
+        tracker.record(10 ** 9, 0, 0, 0, 0)
+
+        self.assertEqual(tracker.budget_state(), BUDGET_NORMAL)
+
+    def test_hourly_thresholds(self):
+        tracker = UsageTracker(self.path, tokens_per_hour=1000, reduce_threshold=0.8)
+        tracker.record(799, 0, 0, 0, 0)
+        self.assertEqual(tracker.budget_state(), BUDGET_NORMAL)
+        tracker.record(1, 0, 0, 0, 0)
+        self.assertEqual(tracker.budget_state(), BUDGET_REDUCED)
+        tracker.record(199, 0, 0, 0, 0)
+        self.assertEqual(tracker.budget_state(), BUDGET_REDUCED)
+        tracker.record(0, 1, 0, 0, 0)
+        self.assertEqual(tracker.budget_state(), BUDGET_EXHAUSTED)
+
+        # Usage older than an hour no longer counts against the hourly limit
+        self.mock_time.return_value = NOW + HOUR + 1
+        self.assertEqual(tracker.budget_state(), BUDGET_NORMAL)
+
+    def test_daily_thresholds(self):
+        self.write_entries(2 * HOUR, 2 * HOUR)
+        tracker = UsageTracker(self.path, tokens_per_hour=1000, tokens_per_day=25, reduce_threshold=0.8)
+        self.assertEqual(tracker.budget_state(), BUDGET_REDUCED)
+        tracker.record(3, 0, 0, 0, 0)
+        self.assertEqual(tracker.budget_state(), BUDGET_EXHAUSTED)
+
+
+class HelperTest(unittest.TestCase):
+    def test_png_dimensions(self):
+        self.assertEqual(get_image_dimensions("image.png", png_header(1920, 1080)), (1920, 1080))
+
+    def test_unknown_dimensions(self):
+        with mock.patch.object(snapsense.subprocess, "run", side_effect=FileNotFoundError):
+            self.assertEqual(get_image_dimensions("image.jpg", b'\xff\xd8\xff'), (0, 0))
+
+    def test_format_bytes(self):
+        self.assertEqual(format_bytes(500), "500 B")
+        self.assertEqual(format_bytes(1536), "1.5 KB")
+        self.assertEqual(format_bytes(5 * 1024 * 1024), "5.0 MB")
+        self.assertEqual(format_bytes(3 * 1024 ** 3), "3.0 GB")
+
+
+class StopWorker(BaseException):
+    """Raised from mocks to break out of the worker loop."""
+
+
+class QueueWorkerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        self.processing_queue = queue.Queue()
+        self.backlog_paths = set()
+        self.deferred_paths = []
+        for name in ("processing_queue", "backlog_paths", "deferred_paths"):
+            patcher = mock.patch.object(snapsense, name, getattr(self, name))
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(snapsense, "logger")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.handler = mock.MagicMock()
+        self.handler.defer_delay = 60
+        self.handler.process_file.side_effect = StopWorker
+        patcher = mock.patch.object(snapsense, "ScreenshotHandler", return_value=self.handler)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_file(self, name, backlog=False):
+        path = os.path.join(self.tmp_dir.name, name)
+        open(path, 'wb').close()
+        if backlog:
+            self.backlog_paths.add(path)
+        return path
+
+    def run_worker(self, *paths):
+        for path in paths:
+            self.processing_queue.put(path)
+        with self.assertRaises(StopWorker):
+            snapsense.process_queue_worker(None)
+
+    def test_reduced_defers_backlog_only(self):
+        self.handler.usage.budget_state.return_value = BUDGET_REDUCED
+        backlog = self.make_file("Screenshot old.png", backlog=True)
+        live = self.make_file("Screenshot new.png")
+
+        self.run_worker(backlog, live)
+
+        self.assertEqual(self.deferred_paths, [backlog])
+        self.handler.process_file.assert_called_once_with(live)
+
+    def test_exhausted_defers_everything(self):
+        backlog = self.make_file("Screenshot old.png", backlog=True)
+        live = self.make_file("Screenshot new.png")
+
+        def budget_state():
+            if len(self.deferred_paths) == 2:
+                raise StopWorker
+            return BUDGET_EXHAUSTED
+        self.handler.usage.budget_state.side_effect = budget_state
+        self.handler.defer_delay = 0
+
+        self.run_worker(backlog, live)
+
+        self.assertEqual(self.deferred_paths, [backlog, live])
+        self.handler.process_file.assert_not_called()
+
+    def test_deferred_paths_resume_when_budget_allows(self):
+        self.handler.usage.budget_state.return_value = BUDGET_NORMAL
+        backlog = self.make_file("Screenshot old.png", backlog=True)
+        self.deferred_paths.append(backlog)
+
+        self.run_worker()
+
+        self.assertEqual(self.deferred_paths, [])
+        self.handler.process_file.assert_called_once_with(backlog)
+
+    def test_missing_files_are_dropped(self):
+        self.handler.usage.budget_state.return_value = BUDGET_NORMAL
+        missing = os.path.join(self.tmp_dir.name, "Screenshot gone.png")
+        self.backlog_paths.add(missing)
+        live = self.make_file("Screenshot new.png")
+
+        self.run_worker(missing, live)
+
+        self.assertNotIn(missing, self.backlog_paths)
+        self.handler.process_file.assert_called_once_with(live)
+
+
+class GenerateFilenameTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(snapsense, "logger")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_reduced_budget_sends_downscaled_image_and_records_usage(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            image_path = os.path.join(tmp_dir, "Screenshot big.png")
+            with open(image_path, 'wb') as f:
+                f.write(png_header(4000, 3000))
+            reduced_data = png_header(1024, 768)
+
+            with mock.patch.dict(os.environ, {"ANTHROPIC_API_KEY": "test"}), \
+                    mock.patch.object(snapsense.anthropic, "Anthropic"):
+                handler = ScreenshotHandler(snapsense.load_config())
+            handler.usage = mock.MagicMock()
+            handler.usage.budget_state.return_value = BUDGET_REDUCED
+            message = handler.client.messages.create.return_value
+            message.usage.input_tokens = 1500
+            message.usage.output_tokens = 12
+            message.content[0].text = "Sales chart"
+
+            with mock.patch.object(snapsense, "downscale_image", return_value=reduced_data) as downscale:
+                self.assertEqual(handler.generate_filename(image_path), "sales-chart")
+
+        downscale.assert_called_once_with(image_path, 1024)
+        handler.usage.record.assert_called_once_with(1500, 12, len(reduced_data), 1024, 768)
+        content = handler.client.messages.create.call_args.kwargs["messages"][0]["content"]
+        self.assertEqual(content[0]["source"]["data"], base64.standard_b64encode(reduced_data).decode("utf-8"))
+
+
+class StatusTest(unittest.TestCase):
+    def test_status_does_not_create_config(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_path = os.path.join(tmp_dir, "config.ini")
+            stdout = io.StringIO()
+            with mock.patch.object(snapsense, "CONFIG_PATH", config_path), \
+                    mock.patch.object(snapsense, "USAGE_PATH", os.path.join(tmp_dir, "usage.jsonl")), \
+                    mock.patch.object(snapsense, "read_pid_file", return_value=None), \
+                    mock.patch.object(sys, "argv", ["snapsense.py", "status"]), \
+                    mock.patch.object(sys, "stdout", stdout):
+                snapsense.main()
+
+            self.assertFalse(os.path.exists(config_path))
+            self.assertEqual(os.listdir(tmp_dir), [])
+        self.assertIn("SnapSense is not running", stdout.getvalue())
+        self.assertIn("Budget: unlimited tokens/hour, unlimited tokens/day (normal)", stdout.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()